@@ -1,81 +1,314 @@
 #!/usr/bin/env python3
 
 import csv
+import heapq
+import mmap
+import stat
 import sys
 import os
-from collections import defaultdict
-from typing import Dict, Tuple, Set
+from array import array
+from collections import Counter
+from multiprocessing import Pool, current_process
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Set
+
+# Approximate number of bytes of flow log text tokenized per batch
+CHUNK_SIZE = 1 << 20
+
+# Smallest share of a flow log worth handing to a separate worker process
+PARALLEL_MIN_BYTES = 32 << 20
+
+MAX_PORT = 0xFFFF
+
+# 3-bit protocol ids used to index the flat lookup array: (port << 3) | id
+PROTOCOL_IDS = {'unknown': 0, 'icmp': 1, 'tcp': 2, 'udp': 3}
+
+# Positions of the fields we need in a default (version 2) VPC flow log record
+DSTPORT_FIELD = 5
+PROTOCOL_FIELD = 7
+MIN_FIELDS = 14
+
+# Protocol number (an 8-bit field) -> name
+_PROTO_TABLE = tuple(
+    {1: 'icmp', 6: 'tcp', 17: 'udp'}.get(protocol_num, 'unknown')
+    for protocol_num in range(256)
+)
+
+# Protocol number -> 3-bit protocol id for the flat lookup array
+_PROTO_ID_TABLE = tuple(PROTOCOL_IDS[name] for name in _PROTO_TABLE)
+
+def _map_file(fileno: int, offset: int = 0, length: int = 0) -> mmap.mmap:
+    """Map a file (or the given aligned part of it) read-only for a sequential scan."""
+    if hasattr(os, 'posix_fadvise'):
+        # Widen the kernel readahead window; readahead then keeps just ahead
+        # of the scan instead of pulling the whole range into the page cache
+        try:
+            os.posix_fadvise(fileno, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass  # Only a hint
+    mm = mmap.mmap(fileno, length, access=mmap.ACCESS_READ, offset=offset)
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return mm
+
+def _iter_chunks(mm: mmap.mmap, start: int, end: int) -> Iterator[bytes]:
+    """Yield slices of mm[start:end] of about CHUNK_SIZE bytes ending on a line break."""
+    pos = start
+    while pos < end:
+        stop = min(pos + CHUNK_SIZE, end)
+        if stop < end:
+            # Lines may end in '\n', '\r\n' or a lone '\r'
+            newline = max(mm.rfind(b'\n', pos, stop), mm.rfind(b'\r', pos, stop))
+            if newline < 0:  # Line longer than a chunk
+                ends = [i for i in (mm.find(b'\n', stop, end), mm.find(b'\r', stop, end)) if i >= 0]
+                newline = min(ends) if ends else -1
+            stop = newline + 1 if newline >= 0 else end
+        yield mm[pos:stop]
+        pos = stop
+
+def _iter_stream_chunks(f) -> Iterator[bytes]:
+    """Yield blocks of about CHUNK_SIZE bytes ending on a line break from a binary stream."""
+    rest = b''
+    while True:
+        block = f.read(CHUNK_SIZE)
+        if not block:
+            if rest:
+                yield rest
+            return
+        block = rest + block
+        # Lines may end in '\n', '\r\n' or a lone '\r'
+        cut = max(block.rfind(b'\n'), block.rfind(b'\r')) + 1
+        rest = block[cut:]
+        if cut:
+            yield block[:cut]
+
+def _extract_pairs(lines: Iterable[bytes]) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield the raw (dst_port, protocol) tokens of every flow log line with enough fields.
+
+    Tokens are counted as-is and converted to integers later, once per
+    distinct pair, since real traffic repeats a small set of them.
+    """
+    for line in lines:
+        fields = line.split()
+        if len(fields) < MIN_FIELDS:  # VPC Flow logs should have at least 14 fields
+            continue
+        yield fields[DSTPORT_FIELD], fields[PROTOCOL_FIELD]
+
+def _split_ranges(flow_log_file: str, size: int, parts: int) -> List[Tuple[str, int, int]]:
+    """Split a file into about `parts` (path, start, end) byte ranges of whole lines."""
+    bounds = [0]
+    with open(flow_log_file, 'rb') as f:
+        for i in range(1, parts):
+            pos = size * i // parts
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos)
+            f.readline()  # Move the cut to the start of the next line
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(flow_log_file, start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def _count_pairs(task: Tuple[str, int, int]) -> Counter:
+    """Count raw (dst_port, protocol) token pairs in one (path, start, end) byte range."""
+    flow_log_file, start, end = task
+    pair_counts: Counter = Counter()
+    # Mapping offsets must be aligned to the allocation granularity
+    offset = start - start % mmap.ALLOCATIONGRANULARITY
+    # Map the file read-only and split it as raw bytes: fields are ASCII,
+    # so nothing is decoded or copied per line.
+    with open(flow_log_file, 'rb') as f, _map_file(f.fileno(), offset, end - offset) as mm:
+        for chunk in _iter_chunks(mm, start - offset, end - offset):
+            # splitlines() accepts '\n', '\r\n' and lone '\r' line endings.
+            # Counter.update does the per-row increments in C.
+            pair_counts.update(_extract_pairs(chunk.splitlines()))
+    return pair_counts
+
+def _available_cpus() -> int:
+    """Number of CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+def _start_pool(processes: int) -> Optional[Pool]:
+    """Start a worker pool, or return None where this process cannot start one."""
+    if current_process().daemon:
+        return None  # Pool workers may not start processes of their own
+    try:
+        return Pool(processes)
+    except (OSError, ImportError):
+        return None  # No working semaphores, e.g. without /dev/shm
 
 class FlowLogParser:
-    def __init__(self, lookup_file: str):
+    def __init__(self, lookup_file: str, collect_port_proto: bool = True,
+                 collect_tags: bool = True):
+        # Reports to build; skipping one skips its counting and its output section
+        self.collect_port_proto = collect_port_proto
+        self.collect_tags = collect_tags
         self.lookup_table: Dict[Tuple[int, str], str] = {}
-        self.tag_counts: Dict[str, int] = defaultdict(int)
-        self.port_protocol_counts: Dict[Tuple[int, str], int] = defaultdict(int)
+        # Flat (port << 3) | protocol_id -> index into tag_list, -1 if untagged
+        self.tag_list: List[str] = []
+        self.lookup_arr = array('i', [-1]) * ((MAX_PORT + 1) << 3)
+        self.tag_counts: Counter = Counter()
+        self.port_protocol_counts: Counter = Counter()
         self.load_lookup_table(lookup_file)
 
     def load_lookup_table(self, lookup_file: str) -> None:
         """Load the lookup table from CSV file."""
+        tag_ids: Dict[str, int] = {}
         with open(lookup_file, 'r') as f:
-            reader = csv.DictReader(f)
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass  # Only a hint; pipes, for one, reject it
+            reader = csv.reader(f)
+            # Resolve column positions once from the header
+            header = next(reader, [])
+            try:
+                port_col = header.index('dstport')
+                protocol_col = header.index('protocol')
+                tag_col = header.index('tag')
+            except ValueError:
+                return  # Missing columns: no usable rows
             for row in reader:
                 try:
-                    dstport = int(row['dstport'])
-                    protocol = row['protocol'].lower().strip()
-                    tag = row['tag'].strip()
-                    # Store tag in lowercase for case-insensitive matching
-                    self.lookup_table[(dstport, protocol)] = tag.lower()
-                except (ValueError, KeyError):
+                    dstport = int(row[port_col])
+                    # Lowercase once here for case-insensitive matching
+                    protocol = row[protocol_col].strip().lower()
+                    tag = row[tag_col].strip().lower()
+                except (ValueError, IndexError):
                     continue  # Skip invalid rows
+                if not 0 <= dstport <= MAX_PORT:
+                    continue  # Ports are 16-bit
+                self.lookup_table[(dstport, protocol)] = tag
+                if protocol in PROTOCOL_IDS:
+                    if tag not in tag_ids:
+                        tag_ids[tag] = len(self.tag_list)
+                        self.tag_list.append(tag)
+                    self.lookup_arr[(dstport << 3) | PROTOCOL_IDS[protocol]] = tag_ids[tag]
 
-    def parse_flow_log(self, flow_log_file: str) -> None:
-        """Parse the flow log file and count matches."""
-        with open(flow_log_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Parse flow log fields
-                fields = line.split()
-                if len(fields) < 14:  # VPC Flow logs should have at least 14 fields
-                    continue
-                
-                try:
-                    # Extract relevant fields
-                    dst_port = int(fields[5])
-                    protocol = self._get_protocol_name(int(fields[7]))
-                    
-                    # Count port/protocol combination
-                    self.port_protocol_counts[(dst_port, protocol)] += 1
-                    
-                    # Look up tag (case-insensitive)
-                    tag = self.lookup_table.get((dst_port, protocol), 'Untagged')
-                    self.tag_counts[tag] += 1
-                except (ValueError, IndexError):
-                    continue  # Skip invalid entries
+    def parse_flow_log(self, flow_log_file: str, workers: Optional[int] = None) -> None:
+        """Parse the flow log file and count matches.
+
+        Logs of at least PARALLEL_MIN_BYTES per worker are split into byte
+        ranges of whole lines and counted in up to `workers` processes
+        (default: one per CPU available to this process). Where no worker
+        pool can be started, e.g. inside a pool worker, the log is parsed
+        in-process instead.
+        """
+        # Count raw (port, protocol) token pairs first; they are converted
+        # and tagged afterwards, once per distinct pair.
+        pair_counts: Counter = Counter()
+        with open(flow_log_file, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                # Pipes and devices have no size and cannot be mapped: stream them
+                for chunk in _iter_stream_chunks(f):
+                    pair_counts.update(_extract_pairs(chunk.splitlines()))
+                self._accumulate(pair_counts)
+                return
+        size = st.st_size
+        if workers is None:
+            workers = _available_cpus()
+        parts = max(1, min(workers, size // PARALLEL_MIN_BYTES))
+        ranges = _split_ranges(flow_log_file, size, parts) if size else []
+
+        pool = _start_pool(len(ranges)) if len(ranges) > 1 else None
+        if pool is not None:
+            with pool:
+                for counts in pool.imap_unordered(_count_pairs, ranges):
+                    pair_counts.update(counts)
+        elif size:
+            # Single range, or no pool available here: count the whole file in-process
+            pair_counts = _count_pairs((flow_log_file, 0, size))
+        self._accumulate(pair_counts)
+
+    def _accumulate(self, pair_counts: Dict[Tuple[bytes, bytes], int]) -> None:
+        """Fold raw (port, protocol) token counts into the result counters.
+
+        Numbers, protocol names and tags are resolved once per distinct pair
+        rather than once per flow log line.
+        """
+        # Per-tag totals indexed by tag id; the extra last slot (id -1) is 'Untagged'
+        tag_totals = [0] * (len(self.tag_list) + 1)
+        for (port_token, protocol_token), count in pair_counts.items():
+            # Plain ASCII digits only: cheaper than letting int() raise
+            if not (port_token.isdigit() and protocol_token.isdigit()):
+                continue  # Skip invalid entries
+            # Bound the significant digits before int(), so overlong tokens are
+            # handled the same whatever the interpreter's int() digit limit
+            port_digits = port_token.lstrip(b'0')
+            protocol_digits = protocol_token.lstrip(b'0')
+            if len(port_digits) > 5:
+                continue  # Ports are 16-bit
+            try:
+                dst_port = int(port_digits or b'0')
+                # More than 3 digits is past the 8-bit field: 'unknown'
+                protocol_num = int(protocol_digits or b'0') if len(protocol_digits) <= 3 else 256
+            except ValueError:
+                continue  # Skip invalid entries
+            if dst_port > MAX_PORT:
+                continue  # Ports are 16-bit
+            if protocol_num < 256:
+                protocol = _PROTO_TABLE[protocol_num]
+                protocol_id = _PROTO_ID_TABLE[protocol_num]
+            else:
+                protocol, protocol_id = 'unknown', PROTOCOL_IDS['unknown']
+
+            # Count port/protocol combination
+            if self.collect_port_proto:
+                self.port_protocol_counts[(dst_port, protocol)] += count
+            if not self.collect_tags:
+                continue
+
+            # Look up tag by direct array index instead of hashing a tuple
+            tag_id = self.lookup_arr[(dst_port << 3) | protocol_id]
+            tag_totals[tag_id] += count
+
+        # Decode tag ids back to names only once, at the end
+        for tag, total in zip(self.tag_list + ['Untagged'], tag_totals):
+            if total:
+                self.tag_counts[tag] += total
 
     def _get_protocol_name(self, protocol_num: int) -> str:
         """Convert protocol number to name."""
-        protocol_map = {
-            1: 'icmp',
-            6: 'tcp',
-            17: 'udp'
-        }
-        return protocol_map.get(protocol_num, 'unknown').lower()
-
-    def write_results(self, output_file: str) -> None:
-        """Write results to output file."""
-        with open(output_file, 'w') as f:
-            # Write tag counts
-            f.write("Tag Counts:\n")
-            f.write("Tag,Count\n")
-            for tag, count in sorted(self.tag_counts.items()):
-                f.write(f"{tag},{count}\n")
-            
-            f.write("\nPort/Protocol Combination Counts:\n")
-            f.write("Port,Protocol,Count\n")
-            for (port, protocol), count in sorted(self.port_protocol_counts.items()):
-                f.write(f"{port},{protocol},{count}\n")
+        if 0 <= protocol_num < 256:
+            return _PROTO_TABLE[protocol_num]
+        return 'unknown'
+
+    def write_results(self, output_file: str, top_n: Optional[int] = None) -> None:
+        """Write results to output file.
+
+        If top_n is given, only the top_n most frequent port/protocol
+        combinations are written, most frequent first.
+        """
+        # Build every line first and hand them to the file in one call
+        lines = []
+        if self.collect_tags:
+            # Tag counts
+            lines.append("Tag Counts:\n")
+            lines.append("Tag,Count\n")
+            lines.extend(f"{tag},{count}\n" for tag, count in sorted(self.tag_counts.items()))
+
+        if self.collect_port_proto:
+            if self.collect_tags:
+                lines.append("\n")
+            lines.append("Port/Protocol Combination Counts:\n")
+            lines.append("Port,Protocol,Count\n")
+            if top_n is None:
+                # Keys are unique, so sort on them alone rather than on whole items
+                combinations = sorted(self.port_protocol_counts.items(), key=itemgetter(0))
+            else:
+                # Bounded heap; ties are broken by port/protocol for stable output
+                combinations = heapq.nsmallest(top_n, self.port_protocol_counts.items(),
+                                               key=lambda item: (-item[1], item[0]))
+            lines.extend(f"{port},{protocol},{count}\n"
+                         for (port, protocol), count in combinations)
+
+        with open(output_file, 'w', buffering=1 << 20) as f:
+            f.writelines(lines)
 
 def main():
     # Default file names
@@ -4,7 +4,9 @@ import unittest
 import tempfile
 import os
 import shutil
-from flow_log_parser import FlowLogParser
+import threading
+from unittest import mock
+from flow_log_parser import FlowLogParser, PROTOCOL_IDS
 
 class TestFlowLogParser(unittest.TestCase):
     def setUp(self):
@@ -55,6 +57,30 @@ class TestFlowLogParser(unittest.TestCase):
         self.assertEqual(self.parser.lookup_table[(25, 'tcp')], 'mail')  # Test whitespace handling
         self.assertNotIn(('invalid', 'tcp'), self.parser.lookup_table)  # Invalid port should be skipped
 
+    def test_lookup_table_columns(self):
+        """Test lookup tables with reordered, missing or short columns"""
+        reordered = os.path.join(self.temp_dir, 'reordered_lookup.csv')
+        with open(reordered, 'w') as f:
+            f.write("tag,protocol,dstport\n")
+            f.write("web,tcp,80\n")
+            f.write("dns,udp\n")  # Short row
+        parser = FlowLogParser(reordered)
+        self.assertEqual(parser.lookup_table, {(80, 'tcp'): 'web'})
+
+        missing = os.path.join(self.temp_dir, 'missing_lookup.csv')
+        with open(missing, 'w') as f:
+            f.write("dstport,tag\n")
+            f.write("80,web\n")
+        parser = FlowLogParser(missing)
+        self.assertEqual(parser.lookup_table, {})
+
+    def test_flat_lookup_array(self):
+        """Test that the flat lookup array agrees with the lookup table"""
+        for (port, protocol), tag in self.parser.lookup_table.items():
+            tag_id = self.parser.lookup_arr[(port << 3) | PROTOCOL_IDS[protocol]]
+            self.assertEqual(self.parser.tag_list[tag_id], tag)
+        self.assertEqual(self.parser.lookup_arr[(8080 << 3) | PROTOCOL_IDS['tcp']], -1)
+
     def test_protocol_name_conversion(self):
         """Test protocol number to name conversion"""
         self.assertEqual(self.parser._get_protocol_name(6), 'tcp')
@@ -78,6 +104,102 @@ class TestFlowLogParser(unittest.TestCase):
         self.assertEqual(self.parser.port_protocol_counts[(8080, 'tcp')], 1)
         self.assertEqual(self.parser.port_protocol_counts[(80, 'unknown')], 1)  # Protocol 99 entry
 
+    def test_chunk_boundaries(self):
+        """Test that lines are not split or lost across read chunks"""
+        with mock.patch('flow_log_parser.CHUNK_SIZE', 64):
+            self.parser.parse_flow_log(self.flow_log_file)
+        self.assertEqual(self.parser.tag_counts['web'], 2)
+        self.assertEqual(self.parser.tag_counts['dns'], 1)
+        self.assertEqual(self.parser.tag_counts['Untagged'], 2)
+        self.assertEqual(sum(self.parser.port_protocol_counts.values()), 5)
+
+    def test_parallel_parsing(self):
+        """Test that parsing byte ranges in worker processes matches a serial parse"""
+        serial = FlowLogParser(self.lookup_file)
+        serial.parse_flow_log(self.flow_log_file, workers=1)
+        with mock.patch('flow_log_parser.PARALLEL_MIN_BYTES', 1):
+            self.parser.parse_flow_log(self.flow_log_file, workers=3)
+        self.assertEqual(dict(self.parser.tag_counts), dict(serial.tag_counts))
+        self.assertEqual(dict(self.parser.port_protocol_counts), dict(serial.port_protocol_counts))
+
+    def test_parallel_fallback(self):
+        """Test that parsing falls back to one process where no pool can be started"""
+        serial = FlowLogParser(self.lookup_file)
+        serial.parse_flow_log(self.flow_log_file, workers=1)
+
+        # Inside a daemonic pool worker no pool is attempted
+        with mock.patch('flow_log_parser.PARALLEL_MIN_BYTES', 1), \
+                mock.patch('flow_log_parser.current_process') as current, \
+                mock.patch('flow_log_parser.Pool') as pool:
+            current.return_value.daemon = True
+            self.parser.parse_flow_log(self.flow_log_file, workers=3)
+        pool.assert_not_called()
+        self.assertEqual(dict(self.parser.tag_counts), dict(serial.tag_counts))
+        self.assertEqual(dict(self.parser.port_protocol_counts), dict(serial.port_protocol_counts))
+
+        # Pool creation failing, e.g. without /dev/shm
+        parser = FlowLogParser(self.lookup_file)
+        with mock.patch('flow_log_parser.PARALLEL_MIN_BYTES', 1), \
+                mock.patch('flow_log_parser.Pool', side_effect=OSError):
+            parser.parse_flow_log(self.flow_log_file, workers=3)
+        self.assertEqual(dict(parser.tag_counts), dict(serial.tag_counts))
+        self.assertEqual(dict(parser.port_protocol_counts), dict(serial.port_protocol_counts))
+
+    def test_crlf_line_endings(self):
+        """Test that Windows line endings are handled"""
+        crlf_flow = os.path.join(self.temp_dir, 'crlf_flow.log')
+        with open(self.flow_log_file, 'rb') as src, open(crlf_flow, 'wb') as dst:
+            dst.write(src.read().replace(b'\n', b'\r\n'))
+        self.parser.parse_flow_log(crlf_flow)
+        self.assertEqual(self.parser.tag_counts['web'], 2)
+        self.assertEqual(self.parser.tag_counts['Untagged'], 2)
+
+    def test_cr_line_endings(self):
+        """Test that old Mac (CR-only) line endings are handled, across chunks too"""
+        cr_flow = os.path.join(self.temp_dir, 'cr_flow.log')
+        with open(self.flow_log_file, 'rb') as src, open(cr_flow, 'wb') as dst:
+            dst.write(src.read().replace(b'\n', b'\r'))
+        with mock.patch('flow_log_parser.CHUNK_SIZE', 64):
+            self.parser.parse_flow_log(cr_flow)
+        self.assertEqual(self.parser.tag_counts['web'], 2)
+        self.assertEqual(self.parser.tag_counts['dns'], 1)
+        self.assertEqual(self.parser.tag_counts['Untagged'], 2)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "requires named pipes")
+    def test_pipe_input(self):
+        """Test that a flow log read from a named pipe is streamed and counted"""
+        fifo = os.path.join(self.temp_dir, 'flow.fifo')
+        os.mkfifo(fifo)
+
+        def feed():
+            with open(self.flow_log_file, 'rb') as src, open(fifo, 'wb') as dst:
+                dst.write(src.read())
+
+        writer = threading.Thread(target=feed)
+        writer.start()
+        with mock.patch('flow_log_parser.CHUNK_SIZE', 64):
+            self.parser.parse_flow_log(fifo)
+        writer.join()
+        self.assertEqual(self.parser.tag_counts['web'], 2)
+        self.assertEqual(self.parser.tag_counts['dns'], 1)
+        self.assertEqual(self.parser.tag_counts['Untagged'], 2)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "requires named pipes")
+    def test_pipe_lookup_table(self):
+        """Test that a lookup table read from a named pipe is loaded"""
+        fifo = os.path.join(self.temp_dir, 'lookup.fifo')
+        os.mkfifo(fifo)
+
+        def feed():
+            with open(self.lookup_file, 'rb') as src, open(fifo, 'wb') as dst:
+                dst.write(src.read())
+
+        writer = threading.Thread(target=feed)
+        writer.start()
+        parser = FlowLogParser(fifo)
+        writer.join()
+        self.assertEqual(parser.lookup_table, self.parser.lookup_table)
+
     def test_output_file_generation(self):
         """Test output file format and content"""
         self.parser.parse_flow_log(self.flow_log_file)
@@ -97,6 +219,41 @@ class TestFlowLogParser(unittest.TestCase):
         self.assertTrue(separator_index > 2)  # At least some tag counts
         self.assertTrue(len(lines) > separator_index + 2)  # At least some port/protocol counts
 
+    def test_single_report(self):
+        """Test collecting and writing only one of the two reports"""
+        parser = FlowLogParser(self.lookup_file, collect_port_proto=False)
+        parser.parse_flow_log(self.flow_log_file)
+        parser.write_results(self.output_file)
+        self.assertEqual(parser.tag_counts['web'], 2)
+        self.assertEqual(len(parser.port_protocol_counts), 0)
+        with open(self.output_file, 'r') as f:
+            content = f.read()
+        self.assertTrue(content.startswith("Tag Counts:\n"))
+        self.assertNotIn("Port/Protocol Combination Counts:", content)
+
+        parser = FlowLogParser(self.lookup_file, collect_tags=False)
+        parser.parse_flow_log(self.flow_log_file)
+        parser.write_results(self.output_file)
+        self.assertEqual(len(parser.tag_counts), 0)
+        self.assertEqual(parser.port_protocol_counts[(80, 'tcp')], 1)
+        with open(self.output_file, 'r') as f:
+            content = f.read()
+        self.assertTrue(content.startswith("Port/Protocol Combination Counts:\n"))
+        self.assertNotIn("Tag Counts:", content)
+
+    def test_top_n_output(self):
+        """Test limiting the output to the most frequent port/protocol combinations"""
+        with open(self.flow_log_file, 'a') as f:
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 53 12351 17 10 100 1234567890 1234567891 ACCEPT OK\n")
+        self.parser.parse_flow_log(self.flow_log_file)
+        self.parser.write_results(self.output_file, top_n=2)
+
+        with open(self.output_file, 'r') as f:
+            lines = [line.strip() for line in f]
+        start = lines.index("Port,Protocol,Count") + 1
+        # Most frequent first, ties ordered by port/protocol
+        self.assertEqual(lines[start:], ["53,udp,2", "80,tcp,1"])
+
     def test_empty_files(self):
         """Test handling of empty files"""
         # Create empty files
@@ -158,5 +315,29 @@ class TestFlowLogParser(unittest.TestCase):
         parser.parse_flow_log(invalid_flow)
         self.assertEqual(sum(parser.tag_counts.values()), 0)  # No valid entries should be counted
 
+        # Test signed, non-ASCII, out-of-range and overlong port numbers in flow log
+        with open(invalid_flow, 'w', encoding='utf-8') as f:
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 65536 12348 6 10 100 1234567890 1234567891 ACCEPT OK\n")
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 " + "9" * 5000 + " 12348 6 10 100 1234567890 1234567891 ACCEPT OK\n")
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 -80 12348 6 10 100 1234567890 1234567891 ACCEPT OK\n")
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 \u0668\u0660 12348 6 10 100 1234567890 1234567891 ACCEPT OK\n")
+
+        parser = FlowLogParser(self.lookup_file)
+        parser.parse_flow_log(invalid_flow)
+        self.assertEqual(sum(parser.tag_counts.values()), 0)  # No valid entries should be counted
+
+    def test_zero_padded_and_overlong_numbers(self):
+        """Test that leading zeros are ignored and overlong protocols map to unknown"""
+        padded_flow = os.path.join(self.temp_dir, 'padded_flow.log')
+        with open(padded_flow, 'w') as f:
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 " + "0" * 5000 + "80 12348 " + "0" * 5000 + "6 10 100 1234567890 1234567891 ACCEPT OK\n")
+            f.write("2 123456789012 eni-1234567890 10.0.1.1 10.0.1.2 80 12348 " + "9" * 5000 + " 10 100 1234567890 1234567891 ACCEPT OK\n")
+
+        self.parser.parse_flow_log(padded_flow)
+        self.assertEqual(self.parser.tag_counts['web'], 1)
+        self.assertEqual(self.parser.tag_counts['Untagged'], 1)
+        self.assertEqual(self.parser.port_protocol_counts[(80, 'tcp')], 1)
+        self.assertEqual(self.parser.port_protocol_counts[(80, 'unknown')], 1)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file